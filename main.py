@@ -5,6 +5,7 @@ from collections import deque
 import requests
 from activity_reporter import create_reporter
 from status_watcher import start_status_watcher  # watcher לרסס
+from profiler import start_profile
 
 # ========= ENV =========
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -29,9 +30,25 @@ STATUS_FEED_URL    = os.getenv("STATUS_FEED_URL", "").strip()      # למשל: h
 STATUS_POLL_SEC    = int(os.getenv("STATUS_POLL_SEC", "180"))
 STATUS_STATE_PATH  = os.getenv("STATUS_STATE_PATH", "/tmp/status_feed_state.json")
 
+# ======== Probes (ENV) ========
+# light = stream, עצירה אחרי headers / תקציב בתים קטן; full = התנהגות ישנה (הורדת גוף מלא)
+PROBE_MODE         = os.getenv("PROBE_MODE", "light").strip().lower()
+PROBE_MAX_BYTES    = int(os.getenv("PROBE_MAX_BYTES", "0"))  # 0 = headers בלבד
+# גוף עם Content-Length עד הסף הזה נקרא עד הסוף כדי שהחיבור יחזור ל-pool (בלי handshake חדש)
+PROBE_DRAIN_BYTES  = int(os.getenv("PROBE_DRAIN_BYTES", "16384"))
+
 last_status = None
 running = True  # נשלט ע״י /pause ו-/resume
 
+# Session לכל thread (monitor ו-/now ב-polling) – requests.Session אינו thread-safe.
+# חיבור חוזר ל-pool (ונחסך handshake) רק כשהגוף נקרא עד הסוף:
+# HEAD, גוף ריק, או Content-Length קטן מ-PROBE_DRAIN_BYTES. אחרת החיבור נסגר.
+_http_local = threading.local()
+
+# סטטיסטיקת בדיקות: name -> {count, last_bytes, total_bytes, last_ms, last_code}
+probe_stats: dict[str, dict] = {}
+_probe_lock = threading.Lock()
+
 # ========= Reporter init =========
 reporter = None
 if MONGODB_URI:
@@ -66,6 +83,84 @@ def send(text: str, chat_id: str | None = None, user_id: str | None = None) -> N
         pass
 
 
+def _record_probe(name: str, nbytes: int, ms: float, code: int | None) -> None:
+    with _probe_lock:
+        st = probe_stats.setdefault(name, {"count": 0, "total_bytes": 0})
+        st["count"] += 1
+        st["total_bytes"] += nbytes
+        st["last_bytes"] = nbytes
+        st["last_ms"] = round(ms, 1)
+        st["last_code"] = code
+
+
+def _http() -> requests.Session:
+    sess = getattr(_http_local, "session", None)
+    if sess is None:
+        sess = _http_local.session = requests.Session()
+    return sess
+
+
+def _header_bytes(resp: requests.Response) -> int:
+    # הערכת גודל ה-headers (שורת סטטוס + "k: v\r\n")
+    return 16 + sum(len(k) + len(v) + 4 for k, v in resp.headers.items())
+
+
+def _probe(name: str, method: str, url: str, timeout: float, **kwargs) -> int:
+    """בקשת בדיקה קלה: stream, קריאה של עד PROBE_MAX_BYTES מהגוף ושחרור החיבור.
+
+    מחזיר את קוד הסטטוס. הבתים שעברו (headers משוערים + גוף, כולל קפיצות redirect)
+    נרשמים ב-probe_stats, והזמן הוא עד קבלת ה-headers – כך שהתזמון משקף את זמינות
+    השרת ולא את גודל הדף. ב-PROBE_MODE=full הגוף נקרא במלואו (התנהגות ישנה) אך עדיין נמדד.
+    """
+    t0 = time.perf_counter()
+    ms: float | None = None
+    code: int | None = None
+    nbytes = 0
+    try:
+        r = _http().request(method, url, timeout=timeout, stream=True, **kwargs)
+        ms = (time.perf_counter() - t0) * 1000
+        released = False
+        try:
+            code = r.status_code
+            # requests קורא את גוף כל redirect במלואו (גודל אחרי פריסה – הערכה)
+            for hop in r.history:
+                nbytes += _header_bytes(hop) + len(hop.content or b"")
+            nbytes += _header_bytes(r)
+            if method == "HEAD" or code in (204, 304):
+                drain, budget = True, 0
+            else:
+                cl = r.headers.get("Content-Length", "")
+                small = cl.isascii() and cl.isdigit() and int(cl) <= PROBE_DRAIN_BYTES
+                drain = PROBE_MODE == "full" or small
+                budget = PROBE_MAX_BYTES
+            if drain or budget > 0:
+                body = 0
+                # קריאה גולמית בלי פריסת gzip – סופרים בתים כפי שעברו בקו;
+                # בלי drain לא קוראים יותר מהתקציב שנשאר
+                while True:
+                    amt = 8192 if drain else min(8192, budget - body)
+                    if amt <= 0:
+                        break
+                    chunk = r.raw.read(amt, decode_content=False)
+                    if not chunk:
+                        break
+                    body += len(chunk)
+                nbytes += body
+            if drain:
+                # הגוף נקרא עד EOF – מחזירים את החיבור ל-pool לשימוש חוזר
+                r.raw.release_conn()
+                released = True
+        finally:
+            # גוף שלא נקרא עד הסוף – סוגרים את החיבור (לא ניתן להחזירו ל-pool)
+            if not released:
+                r.close()
+        return r.status_code
+    finally:
+        if ms is None:
+            ms = (time.perf_counter() - t0) * 1000
+        _record_probe(name, nbytes, ms, code)
+
+
 def check_cursor_ai() -> bool:
     """בדיקת בריאות מרוככת ל-AI: כל סטטוס שאינו 5xx נחשב UP (429 גם נחשב UP).
 
@@ -76,22 +171,28 @@ def check_cursor_ai() -> bool:
         url = os.getenv("AI_HEALTH_URL", "https://api2.cursor.sh").strip()
         # HEAD לבריאות, GET לשורש – עם עקיבה אחרי הפניות
         if url.endswith("/health"):
-            r = requests.head(url, timeout=10, allow_redirects=True)
+            code = _probe("ai", "HEAD", url, timeout=10, allow_redirects=True)
         else:
-            r = requests.get(url, timeout=10, allow_redirects=True)
-        code = r.status_code
+            code = _probe("ai", "GET", url, timeout=10, allow_redirects=True)
         if code == 429:
             return True
         return code < 500
     except Exception:
         # ניסיון רזרבי על נקודת הצ'אט – נחשב כל קוד <500 או 429 כ-UP
+        # במצב light שולחים גוף ריק (בלי מודל) – מספיק כדי לקבל קוד מהשרת
+        payload = (
+            {"messages": [{"role": "user", "content": "ping"}], "model": "gpt-4"}
+            if PROBE_MODE == "full"
+            else {}
+        )
         try:
-            r = requests.post(
+            code = _probe(
+                "ai_fallback",
+                "POST",
                 "https://api2.cursor.sh/aiserver.v1.ChatService/StreamUnifiedChatWithTools",
-                json={"messages": [{"role": "user", "content": "ping"}], "model": "gpt-4"},
                 timeout=12,
+                json=payload,
             )
-            code = r.status_code
             if code == 429:
                 return True
             return code < 500
@@ -102,12 +203,21 @@ def check_cursor_ai() -> bool:
 def check_site_ok() -> bool:
     """בודק שהאתר הראשי מחזיר 200 (מרוכך כדי להימנע מ-False DOWN)."""
     try:
-        r = requests.get("https://cursor.sh", timeout=10)
-        return r.status_code == 200
+        return _probe("site", "GET", "https://cursor.sh", timeout=10) == 200
     except Exception:
         return False
 
 
+def _format_probe_stats() -> str:
+    with _probe_lock:
+        rows = [
+            f"• {name}: {st.get('last_bytes', 0)}B/{st.get('last_ms', 0)}ms "
+            f"(total {st['total_bytes']}B in {st['count']})"
+            for name, st in sorted(probe_stats.items())
+        ]
+    return "\n".join(rows)
+
+
 def monitor_loop() -> None:
     """
     'עלה' = גם ה-AI וגם האתר OK (AND), וגם:
@@ -179,7 +289,7 @@ def monitor_loop() -> None:
 
 
 def polling_loop() -> None:
-    """פקודות טלגרם: /pause /resume /status /now /last"""
+    """פקודות טלגרם: /pause /resume /status /now /last /incidents /profile"""
     global running
     offset = None
 
@@ -264,27 +374,53 @@ def polling_loop() -> None:
                         f"• AND:  {'OK' if both else 'DOWN'}\n"
                         f"• Mode[{mode_label}]: {'OK' if tgt else 'DOWN'}"
                     )
+                    stats = _format_probe_stats()
+                    if stats:
+                        msg_now += f"\n📏 Probes ({PROBE_MODE}):\n{stats}"
                     send(msg_now, chat_id=chat_id, user_id=user_id)
 
                 elif text == "/last":
                     try:
-                        # נשתמש בפונקציות מהצופה כדי להביא ולפרמט
-                        from status_watcher import _fetch_feed, _format_msg
+                        # קודם מהאינדקס של הצופה (O(1)); אם הצופה לא רץ – מביאים מהפיד
+                        from status_watcher import _fetch_feed, _format_msg, get_latest_incident
+                        inc = get_latest_incident()
                         feed = STATUS_FEED_URL or ""
-                        if not feed:
+                        if inc:
+                            msg = _format_msg(inc["latest"])
+                            send("📡 הפריט האחרון מהפיד:\n" + msg, chat_id=chat_id, user_id=user_id)
+                        elif not feed:
                             send("📡 אין STATUS_FEED_URL מוגדר", chat_id=chat_id, user_id=user_id)
                         else:
                             items = _fetch_feed(feed)
                             if not items:
                                 send("📡 הפיד ריק כרגע", chat_id=chat_id, user_id=user_id)
                             else:
-                                items.sort(key=lambda x: x.get("updated_ts", 0.0))
-                                latest = items[-1]
+                                latest = max(items, key=lambda x: x.get("updated_ts", 0.0))
                                 msg = _format_msg(latest)
                                 send("📡 הפריט האחרון מהפיד:\n" + msg, chat_id=chat_id, user_id=user_id)
                     except Exception as e:
                         send(f"❗ שגיאה ב-/last: {e}", chat_id=chat_id, user_id=user_id)
 
+                elif text == "/incidents":
+                    from status_watcher import format_incidents
+                    send(format_incidents(), chat_id=chat_id, user_id=user_id)
+
+                elif text == "/profile" or text.startswith("/profile "):
+                    arg = text[len("/profile"):].strip()
+                    secs = int(arg) if arg.isascii() and arg.isdigit() else 60
+
+                    def _send_profile(report: str, _chat=chat_id, _user=user_id) -> None:
+                        # מגבלת אורך הודעה בטלגרם
+                        if len(report) > 4000:
+                            report = report[:3997] + "..."
+                        send(report, chat_id=_chat, user_id=_user)
+
+                    started = start_profile(secs, _send_profile)
+                    if started:
+                        send(f"🧪 Profiling for {started}s…", chat_id=chat_id, user_id=user_id)
+                    else:
+                        send("⚠️ Profiler busy or disabled", chat_id=chat_id, user_id=user_id)
+
         except Exception:
             time.sleep(3)
 
@@ -309,6 +445,7 @@ if __name__ == "__main__":
     )
 
     # מריץ ניטור + קליטת פקודות במקביל
-    threading.Thread(target=monitor_loop, daemon=True).start()
+    threading.Thread(target=monitor_loop, name="monitor", daemon=True).start()
     print("👂 polling_loop started", flush=True)
+    threading.current_thread().name = "polling"
     polling_loop()
@@ -0,0 +1,205 @@
+# profiler.py
+# On-demand profiling: stack sampling across worker threads + tracemalloc diff.
+# Nothing runs (and nothing is traced) until start_profile() is called – zero overhead when idle.
+
+import os
+import sys
+import time
+import threading
+import linecache
+import tokenize
+import tracemalloc
+from collections import Counter
+from typing import Callable, List, Optional, Tuple
+
+# ===== ENV & Defaults =====
+PROFILE_ENABLED     = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+PROFILE_MAX_SEC     = int(os.getenv("PROFILE_MAX_SEC", "300"))
+PROFILE_INTERVAL_MS = int(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_TOP         = int(os.getenv("PROFILE_TOP", "10"))
+PROFILE_DIR         = os.getenv("PROFILE_DIR", "").strip()  # אם הוגדר – הדו"ח המלא נכתב לקובץ
+# פונקציות שמעניינות אותנו במיוחד – מוצגות בנפרד גם אם אינן ב-top
+PROFILE_FOCUS       = [
+    f.strip()
+    for f in os.getenv(
+        "PROFILE_FOCUS",
+        "watch_once,_fetch_feed,_parse_atom,_parse_rss,_probe,check_cursor_ai,check_site_ok",
+    ).split(",")
+    if f.strip()
+]
+
+_RUN_LOCK = threading.Lock()  # פרופיל אחד בכל פעם
+
+# המתנות חוסמות (leaf frame) – נספרות בדלי "idle" ולא כ-hot functions
+_IDLE_LEAVES = {
+    ("socket.py", "readinto"),
+    ("socket.py", "accept"),
+    ("ssl.py", "read"),
+    ("ssl.py", "recv_into"),
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+}
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+        return True
+    # time.sleep הוא C builtin – ה-leaf הוא הקורא, לכן בודקים שהשורה שבה הוא עומד היא קריאת sleep
+    line = linecache.getline(code.co_filename, frame.f_lineno).lstrip()
+    return line.startswith(("time.sleep(", "sleep("))
+
+
+def _sample_stacks(
+    seconds: float, interval: float
+) -> Tuple[Counter, Counter, Counter, Counter, Counter, int]:
+    """דגימת מחסניות (wall-clock) של כל ה-threads (חוץ מה-sampler עצמו).
+
+    מחזיר (self, idle, cumulative, per-thread, per-thread idle, מספר דגימות).
+    self = הפונקציה בראש המחסנית כשה-thread לא ממתין; idle = דגימות שה-leaf שלהן הוא
+    המתנה חוסמת (sleep, קריאת socket/ssl, wait); cumulative = כל פונקציה במחסנית.
+    """
+    own = threading.get_ident()
+    self_c: Counter = Counter()
+    idle_c: Counter = Counter()
+    cum_c: Counter = Counter()
+    thread_c: Counter = Counter()
+    thread_idle_c: Counter = Counter()
+    samples = 0
+    # מפת שמות ה-threads נבנית מחדש רק כשמופיע thread חדש – threading.enumerate()
+    # בכל דגימה היה מופיע בראש טבלת ההקצאות ומסתיר את ההקצאות של ה-workers
+    names = {t.ident: t.name for t in threading.enumerate()}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            if ident not in names:
+                names = {t.ident: t.name for t in threading.enumerate()}
+            tname = names.get(ident, str(ident))
+            thread_c[tname] += 1
+            if _is_idle(frame):
+                thread_idle_c[tname] += 1
+                idle_c[_frame_label(frame.f_code)] += 1
+            else:
+                self_c[_frame_label(frame.f_code)] += 1
+            seen = set()
+            f = frame
+            while f is not None:
+                label = _frame_label(f.f_code)
+                if label not in seen:
+                    seen.add(label)
+                    cum_c[label] += 1
+                f = f.f_back
+        samples += 1
+        time.sleep(interval)
+    return self_c, idle_c, cum_c, thread_c, thread_idle_c, samples
+
+
+def _format_report(
+    seconds: int,
+    samples: int,
+    stacks: Tuple[Counter, Counter, Counter, Counter, Counter, int],
+    alloc: List[tracemalloc.StatisticDiff],
+    top: int,
+) -> str:
+    self_c, idle_c, cum_c, thread_c, thread_idle_c, _ = stacks
+    total = sum(thread_c.values()) or 1
+    lines = [
+        f"🧪 Profile {seconds}s – {samples} samples, interval {PROFILE_INTERVAL_MS}ms",
+        "(% = share of wall-clock thread samples)",
+    ]
+
+    lines.append("🧵 Threads (samples / idle):")
+    lines += [f"• {name}: {n} / {thread_idle_c[name]}" for name, n in thread_c.most_common()]
+
+    lines.append(f"🔥 Top self, busy ({top}):")
+    lines += [f"• {n * 100 / total:.1f}% {label}" for label, n in self_c.most_common(top)]
+
+    lines.append(f"💤 Idle waits ({sum(idle_c.values()) * 100 / total:.1f}%):")
+    lines += [f"• {n * 100 / total:.1f}% {label}" for label, n in idle_c.most_common(3)]
+
+    focus = [(label, n) for label, n in cum_c.items() if label.split(" ", 1)[0] in PROFILE_FOCUS]
+    if focus:
+        lines.append("🎯 Focus (cumulative, incl. waits):")
+        focus.sort(key=lambda x: x[1], reverse=True)
+        lines += [f"• {n * 100 / total:.1f}% {label}" for label, n in focus]
+
+    lines.append(f"🧠 Allocations Δ ({top}):")
+    for st in alloc[:top]:
+        frame = st.traceback[0]
+        lines.append(
+            f"• {st.size_diff / 1024:+.1f} KiB ({st.count_diff:+d}) "
+            f"{os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return "\n".join(lines)
+
+
+def run_profile(seconds: int, top: Optional[int] = None) -> str:
+    """מריץ פרופיל סינכרוני ומחזיר דו"ח טקסט. אם PROFILE_DIR מוגדר – כותב גם לקובץ."""
+    top = top or PROFILE_TOP
+
+    # tracemalloc רץ רק לאורך הפרופיל; אם כבר היה פעיל (PYTHONTRACEMALLOC) – לא עוצרים אותו
+    started_tm = not tracemalloc.is_tracing()
+    if started_tm:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        stacks = _sample_stacks(seconds, PROFILE_INTERVAL_MS / 1000)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_tm:
+            tracemalloc.stop()
+
+    # מסננים את tracemalloc, הפרופיילר עצמו ו-linecache (זיהוי sleep) מתוצאות ההקצאה
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, tokenize.__file__),
+    ]
+    alloc = after.filter_traces(filters).compare_to(before.filter_traces(filters), "lineno")
+    samples = stacks[-1]
+    report = _format_report(seconds, samples, stacks, alloc, top)
+
+    if PROFILE_DIR:
+        path = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            full = _format_report(seconds, samples, stacks, alloc, top * 5)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(full + "\n")
+            report += f"\n💾 {path}"
+        except Exception as e:
+            report += f"\n❗ write failed: {e}"
+    return report
+
+
+def start_profile(seconds: int, on_done: Callable[[str], None]) -> int:
+    """מריץ פרופיל ב-thread נפרד ומעביר את הדו"ח ל-on_done.
+
+    מחזיר את משך הפרופיל בפועל (חסום ל-PROFILE_MAX_SEC), או 0 אם כבר רץ פרופיל / מושבת.
+    """
+    if not PROFILE_ENABLED or not _RUN_LOCK.acquire(blocking=False):
+        return 0
+    seconds = max(1, min(int(seconds), PROFILE_MAX_SEC))
+
+    def _run():
+        try:
+            report = run_profile(seconds)
+        except Exception as e:
+            report = f"❗ profile error: {e}"
+        finally:
+            _RUN_LOCK.release()
+        try:
+            on_done(report)
+        except Exception:
+            pass
+
+    threading.Thread(target=_run, name="profiler", daemon=True).start()
+    return seconds
+
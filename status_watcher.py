@@ -1,11 +1,14 @@
 # status_watcher.py
 # Watch Statuspage-style RSS/Atom feed and push concise Hebrew updates.
 # Sends only the *latest* relevant item when STATUS_ONLY_LATEST=true.
+# Items are grouped into an in-memory incident index; notifications are per-incident transitions.
 
 import os
 import time
 import json
 import re
+import zlib
+import threading
 from typing import Callable, Dict, Any, List, Optional
 import requests
 import xml.etree.ElementTree as ET
@@ -51,7 +54,7 @@ def _get_text(elem: Optional[ET.Element]) -> str:
     return _norm(elem.text if elem is not None else "")
 
 
-def _parse_time_guess(s: str) -> float:
+def _parse_time(s: str) -> Optional[float]:
     try:
         from email.utils import parsedate_to_datetime
         return parsedate_to_datetime(s).timestamp()
@@ -60,7 +63,12 @@ def _parse_time_guess(s: str) -> float:
             from datetime import datetime
             return datetime.fromisoformat(s.replace("Z", "+00:00")).timestamp()
         except Exception:
-            return time.time()
+            return None
+
+
+def _parse_time_guess(s: str) -> float:
+    ts = _parse_time(s)
+    return time.time() if ts is None else ts
 
 
 def _fmt_local(ts: float) -> str:
@@ -158,7 +166,14 @@ def _load_state(path: str) -> Dict[str, Any]:
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception:
-        return {"last_ids": [], "last_sent_ts": 0.0, "boot_sent": False}
+        return {
+            "incidents": {},
+            "open_keys": [],
+            "pending": {},
+            "latest_key": None,
+            "last_sent_ts": 0.0,
+            "boot_sent": False,
+        }
 
 
 def _save_state(path: str, state: Dict[str, Any]) -> None:
@@ -226,10 +241,10 @@ def _format_msg(item: Dict[str, Any]) -> str:
     return "\n".join([p for p in parts if p])
 
 
-def _should_send(item: Dict[str, Any]) -> bool:
+def _should_send(item: Dict[str, Any], typ: Optional[str] = None) -> bool:
     title = item.get("title") or ""
     body = item.get("summary") or ""
-    typ = _classify(title, body)
+    typ = typ or _classify(title, body)
     if ONLY_INCIDENTLIKE and typ not in ("incident", "resolved", "monitoring"):
         return False
     if SKIP_ANALYTICS and _is_analytics(title, body):
@@ -237,96 +252,303 @@ def _should_send(item: Dict[str, Any]) -> bool:
     return True
 
 
-def _pick_latest_allowed(items: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
-    allowed = [it for it in items if _should_send(it)]
-    if not allowed:
+# ===== Incident index =====
+# אינדקס תקלות בזיכרון (נשמר גם ב-state): מפתח = link (בלי query/fragment) או קידומת ה-id.
+# כל תקלה מחזיקה מצב מחזור-חיים, זמני first-seen/resolved והעדכון האחרון –
+# כך שהתראות הן מעברי מצב לכל תקלה, ועדכון שכבר נצפה לא מעובד שוב.
+MAX_INCIDENTS = 200
+
+_INDEX_LOCK = threading.Lock()
+_LIVE_STATE: Optional[Dict[str, Any]] = None  # ה-state של הצופה הרץ (ל-/incidents, /last)
+
+
+MAX_SEEN_IDS = 50  # מפתחות עדכונים שנשמרים לכל תקלה לזיהוי כפילויות
+
+
+def _content_digest(item: Dict[str, Any]) -> str:
+    text = f"{item.get('title') or ''}\n{item.get('summary') or ''}"
+    return f"{zlib.crc32(text.encode('utf-8')):08x}"
+
+
+def _update_key(item: Dict[str, Any]) -> str:
+    # Statuspage Atom מעדכן entry במקום (id קבוע, updated/תוכן חדשים) – לכן id לבדו לא מספיק
+    return f"{_norm(item.get('id'))}|{_norm(item.get('updated'))}|{_content_digest(item)}"
+
+
+def _incident_key(item: Dict[str, Any]) -> str:
+    # link שמצביע לשורש האתר (למשל כל פריטי RSS -> דף הסטטוס) לא מזהה תקלה – נופלים ל-id
+    link = _norm(item.get("link")).split("#", 1)[0].split("?", 1)[0].rstrip("/")
+    if link and "/" in link.split("://", 1)[-1]:
+        return link
+    return _norm(item.get("id")).split("#", 1)[0]
+
+
+def _index_item(
+    state: Dict[str, Any], item: Dict[str, Any], key: str, now: float
+) -> Optional[Dict[str, Any]]:
+    """מעדכן את האינדקס בפריט אחד שטרם נצפה.
+
+    כפילות נקבעת לפי (id, updated, תוכן) – seen_ids לכל תקלה; הזמן משמש רק לסדר. פריט בלי
+    תאריך תקין (fallback ל-time.time()) לא משתתף בהשוואת "חדש יותר" ולא תופס את latest_key.
+    מחזיר {"key", "prev", "ts"} אם מצב התקלה השתנה, תקלה חדשה, או תקלה שנפתרה ותוכנה השתנה.
+    """
+    incidents: Dict[str, Dict[str, Any]] = state["incidents"]
+    item_id = _norm(item.get("id"))
+    upd_key = _update_key(item)
+    known_ts = _parse_time(item.get("updated") or "")
+    ts = known_ts if known_ts is not None else now
+    inc = incidents.get(key)
+    if inc is not None:
+        seen: List[str] = inc.setdefault("seen_ids", [])
+        seen.append(upd_key)
+        if len(seen) > MAX_SEEN_IDS:
+            del seen[: len(seen) - MAX_SEEN_IDS]
+        inc["updates"] += 1
+        if known_ts is not None and known_ts < inc["last_update_ts"]:
+            return None  # עדכון ישן שהגיע באיחור – נרשם כנצפה אבל לא משנה מצב
+
+    # מסווגים פעם אחת מהתקציר המלא ושומרים – הסינון לא מסווג שוב מהתקציר הקטוע
+    typ = _classify(item.get("title") or "", item.get("summary") or "")
+    latest = {
+        "id": item_id,
+        "title": item.get("title"),
+        "updated": item.get("updated"),
+        "updated_ts": ts,
+        "link": item.get("link"),
+        "summary": (item.get("summary") or "")[:300],
+        "typ": typ,
+        "allowed": _should_send(item, typ),
+        "digest": _content_digest(item),
+    }
+    if inc is None:
+        inc = {
+            "key": key,
+            "state": typ,
+            "first_seen_ts": ts,
+            "opened_ts": None if typ == "resolved" else ts,
+            "resolved_ts": None,
+            "last_update_ts": ts,
+            "updates": 1,
+            "seen_ids": [upd_key],
+            "latest": latest,
+        }
+        incidents[key] = inc
+        prev = None
+    else:
+        prev = inc["state"]
+        if known_ts is not None:
+            inc["last_update_ts"] = known_ts
+        if prev == "resolved" and typ != "resolved":
+            inc["opened_ts"] = ts  # נפתחה מחדש
+    same_content = inc["latest"].get("digest") == latest["digest"]
+    inc["state"] = typ
+    inc["latest"] = latest
+    if typ != "resolved":
+        inc["resolved_ts"] = None
+    elif prev != "resolved":
+        inc["resolved_ts"] = ts
+
+    open_keys: List[str] = state["open_keys"]
+    if typ == "resolved":
+        if key in open_keys:
+            open_keys.remove(key)
+    elif key not in open_keys:
+        open_keys.append(key)
+
+    latest_key = state.get("latest_key")
+    cur = incidents.get(latest_key or "")
+    if cur is None or (known_ts is not None and known_ts >= cur["last_update_ts"]):
+        state["latest_key"] = key
+
+    if prev == typ and (prev != "resolved" or same_content):
         return None
-    allowed.sort(key=lambda x: x.get("updated_ts", 0.0))
-    return allowed[-1]
+    return {"key": key, "prev": prev, "ts": ts}
+
+
+def _prune_incidents(state: Dict[str, Any]) -> None:
+    incidents: Dict[str, Dict[str, Any]] = state["incidents"]
+    if len(incidents) <= MAX_INCIDENTS:
+        return
+    # מסירים קודם תקלות שנפתרו, מהישנה לחדשה
+    by_age = sorted(
+        incidents.values(), key=lambda i: (i["state"] != "resolved", i["last_update_ts"])
+    )
+    for inc in by_age[: len(incidents) - MAX_INCIDENTS]:
+        key = inc["key"]
+        incidents.pop(key, None)
+        state["pending"].pop(key, None)
+        if key in state["open_keys"]:
+            state["open_keys"].remove(key)
+    if state.get("latest_key") not in incidents:
+        state["latest_key"] = (
+            max(incidents.values(), key=lambda i: i["last_update_ts"])["key"] if incidents else None
+        )
+
+
+def _index_feed(state: Dict[str, Any], items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """מכניס את פריטי הפיד לאינדקס ומחזיר את מעברי המצב שנוצרו (לפי סדר כרונולוגי)."""
+    state.setdefault("incidents", {})
+    state.setdefault("open_keys", [])
+    state.setdefault("pending", {})
+    incidents = state["incidents"]
+
+    # רק עדכונים שטרם נצפו – בדרך כלל 0-1 בכל סבב, כך שהמיון זול
+    new_items = []
+    batch_keys = set()
+    for it in items:
+        key = _incident_key(it)
+        upd_key = _update_key(it)
+        if not key or (key, upd_key) in batch_keys:
+            continue
+        inc = incidents.get(key)
+        if inc is None or upd_key not in inc.get("seen_ids", []):
+            batch_keys.add((key, upd_key))
+            new_items.append((key, it))
+    new_items.sort(key=lambda x: x[1].get("updated_ts", 0.0))
+
+    now = time.time()
+    transitions = []
+    with _INDEX_LOCK:
+        for key, it in new_items:
+            tr = _index_item(state, it, key, now)
+            if tr:
+                transitions.append(tr)
+        _prune_incidents(state)
+    return transitions
+
+
+def _incident_allowed(inc: Dict[str, Any]) -> bool:
+    latest = inc["latest"]
+    if "allowed" in latest:
+        return bool(latest["allowed"])
+    return _should_send(latest, inc["state"])
+
+
+def _format_transition(inc: Dict[str, Any], prev: Optional[str]) -> str:
+    msg = _format_msg(inc["latest"])
+    extra = []
+    if prev and prev != inc["state"]:
+        extra.append(f"↪️ {prev} → {inc['state']}")
+    # משך רק לתקלה שנצפתה פתוחה ועכשיו נפתרה (לא resolved ראשון / resolved → resolved)
+    opened = inc.get("opened_ts") or inc["first_seen_ts"]
+    if inc["state"] == "resolved" and prev not in (None, "resolved") and inc.get("resolved_ts"):
+        mins = int((inc["resolved_ts"] - opened) // 60)
+        extra.append(f"⏱️ {mins} min" if not STATUS_HEBREW else f"⏱️ משך: {mins} דק'")
+    return "\n".join([msg] + extra)
+
+
+def get_latest_incident() -> Optional[Dict[str, Any]]:
+    """העדכון האחרון מהאינדקס של הצופה הרץ (O(1)); None אם הצופה לא רץ או ריק."""
+    st = _LIVE_STATE
+    if not st:
+        return None
+    with _INDEX_LOCK:
+        inc = st.get("incidents", {}).get(st.get("latest_key") or "")
+        return dict(inc) if inc else None
+
+
+def format_incidents() -> str:
+    """תשובה ל-/incidents מתוך האינדקס – תקלות פתוחות + התקלה האחרונה."""
+    st = _LIVE_STATE
+    if not st:
+        return "📡 צופה הסטטוס לא פעיל" if STATUS_HEBREW else "📡 Status watcher not running"
+    with _INDEX_LOCK:
+        incidents = st.get("incidents", {})
+        open_incs = [incidents[k] for k in st.get("open_keys", []) if k in incidents]
+        latest = incidents.get(st.get("latest_key") or "")
+        total = len(incidents)
+        lines = []
+        for inc in open_incs:
+            title = inc["latest"].get("title") or inc["key"]
+            since = _fmt_local(inc["first_seen_ts"])
+            lines.append(f"• [{inc['state']}] {title} ({since}, {inc['updates']} upd)")
+        latest_line = ""
+        if latest:
+            latest_line = f"{latest['state']}: {latest['latest'].get('title') or latest['key']}"
+
+    if STATUS_HEBREW:
+        head = f"📡 תקלות פתוחות: {len(open_incs)} (באינדקס: {total})"
+        tail = f"🕒 אחרון: {latest_line}" if latest_line else ""
+    else:
+        head = f"📡 Open incidents: {len(open_incs)} (indexed: {total})"
+        tail = f"🕒 Latest: {latest_line}" if latest_line else ""
+    return "\n".join([p for p in [head] + lines + [tail] if p])
 
 
 # ===== Core =====
 def watch_once(feed_url: str, state: Dict[str, Any], on_event: Callable[[str], None]) -> Dict[str, Any]:
-    last_ids: List[str] = list(state.get("last_ids", []))
+    global _LIVE_STATE
     last_sent_ts: float = float(state.get("last_sent_ts", 0.0))
     boot_sent: bool = bool(state.get("boot_sent", False))
+    # state ישן (last_ids בלבד) – בונים את האינדקס בשקט כדי לא להציף
+    migrating = boot_sent and "incidents" not in state
+    state.pop("last_ids", None)
     now = time.time()
 
     items = _fetch_feed(feed_url)
+    transitions = _index_feed(state, items)
+    _LIVE_STATE = state
+    incidents: Dict[str, Dict[str, Any]] = state["incidents"]
+    pending: Dict[str, Optional[str]] = state["pending"]
 
-    # שליחה חד-פעמית על Boot (פריט אחרון שעובר מסננים; אם אין – לא שולח)
+    # שליחה חד-פעמית על Boot (התקלה האחרונה שעוברת מסננים; אם אין – לא שולח)
     if SEND_LAST_ON_BOOT and not boot_sent:
-        latest = _pick_latest_allowed(items)
-        if latest:
+        allowed = [inc for inc in incidents.values() if _incident_allowed(inc)]
+        if allowed:
+            latest = max(allowed, key=lambda i: i["last_update_ts"])
             try:
-                on_event(_format_msg(latest))
+                on_event(_format_msg(latest["latest"]))
             except Exception:
                 pass
-        # מסמנים את כולם כנצפו כדי שלא להציף אחר-כך
-        for it in items:
-            _id = it.get("id")
-            if _id and _id not in last_ids:
-                last_ids.append(_id)
         state["last_sent_ts"] = now  # לא מגביל ע"י cooldown על הודעת boot
         state["boot_sent"] = True
-        state["last_ids"] = last_ids
+        return state
+    if migrating:
         return state
 
-    # פריטים חדשים ביחס ל-state
-    fresh: List[Dict[str, Any]] = []
-    for it in items:
-        it_id = it.get("id") or ""
-        if not it_id:
-            continue
-        if it_id in last_ids:
-            continue
+    # מעברים חדשים – נשמר ה-prev הראשון שלא דווח לכל תקלה
+    for tr in transitions:
+        inc = incidents[tr["key"]]
         # מתעלמים מהיסטוריה לפני העלייה אם ביקשת
-        if BOOT_IGNORE_HISTORY and it.get("updated_ts", now) < BOOT_TS:
-            last_ids.append(it_id)
+        if BOOT_IGNORE_HISTORY and tr["ts"] < BOOT_TS:
             continue
-        if not _should_send(it):
-            last_ids.append(it_id)
+        if not _incident_allowed(inc):
+            pending.pop(tr["key"], None)
             continue
-        fresh.append(it)
+        if tr["key"] not in pending:
+            pending[tr["key"]] = tr["prev"]
+
+    fresh = [incidents[k] for k in pending if k in incidents]
 
     if ONLY_LATEST and fresh:
-        # שלח רק את הפריט העדכני ביותר
-        latest = max(fresh, key=lambda x: x.get("updated_ts", 0.0))
+        # שלח רק את התקלה שעודכנה אחרונה
+        latest = max(fresh, key=lambda i: i["last_update_ts"])
         if COOLDOWN_SEC <= 0 or (now - last_sent_ts) >= COOLDOWN_SEC:
             try:
-                on_event(_format_msg(latest))
+                on_event(_format_transition(latest, pending.get(latest["key"])))
                 last_sent_ts = now
             except Exception:
                 pass
-        # סמון כל החדשים כ"נצפו" כדי שלא נצבור backlog
-        for it in fresh:
-            _id = it.get("id")
-            if _id and _id not in last_ids:
-                last_ids.append(_id)
+        # כל המעברים מסומנים כמטופלים כדי שלא נצבור backlog
+        pending.clear()
     else:
-        # התנהגות ישנה – עד MAX_PER_POLL ובהתחשב ב-cooldown
-        fresh.sort(key=lambda x: x.get("updated_ts", now))
+        # התנהגות ישנה – עד MAX_PER_POLL ובהתחשב ב-cooldown; השאר נשארים ב-pending
+        fresh.sort(key=lambda i: i["last_update_ts"])
         sent = 0
-        for it in fresh:
+        for inc in fresh:
             if sent >= MAX_PER_POLL:
                 break
             if COOLDOWN_SEC > 0 and (now - last_sent_ts) < COOLDOWN_SEC:
                 break
             try:
-                on_event(_format_msg(it))
+                on_event(_format_transition(inc, pending.get(inc["key"])))
                 last_sent_ts = now
                 sent += 1
             except Exception:
                 pass
             finally:
-                _id = it.get("id")
-                if _id:
-                    last_ids.append(_id)
-
-    if len(last_ids) > 200:
-        last_ids = last_ids[-200:]
+                pending.pop(inc["key"], None)
 
-    state["last_ids"] = last_ids
     state["last_sent_ts"] = last_sent_ts
     return state
 
@@ -363,5 +585,4 @@ def start_status_watcher(
                 print(f"❗ status watcher error: {e}", flush=True)
             time.sleep(interval)
 
-    import threading as _t
-    _t.Thread(target=_run, daemon=True).start()
+    threading.Thread(target=_run, name="status-watcher", daemon=True).start()